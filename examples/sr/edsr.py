@@ -1,9 +1,12 @@
+import os
+import shutil
 import argparse
 import torch
+from torch.utils.data import DataLoader, default_collate
 from super_image import EdsrModel, ImageLoader
 from super_image.data import EvalDataset, TrainDataset, augment_five_crop
 from super_image import Trainer, TrainingArguments
-from datasets import load_dataset
+from datasets import load_dataset, load_from_disk
 import torch_integral as inn
 from torch_integral.permutation import NOptOutFiltersPermutation
 from torch_integral.utils import standard_continuous_dims
@@ -11,6 +14,52 @@ from PIL import Image
 import requests
 
 
+def channels_last_collate(batch):
+    return [
+        t.contiguous(memory_format=torch.channels_last)
+        for t in default_collate(batch)
+    ]
+
+
+def autocast_training_forward(module):
+    """
+    Runs forward pass of the module in bfloat16 autocast in training mode only.
+    Backward pass, optimizer step and evaluation stay in float32.
+    """
+    forward = module.forward
+
+    def wrapper(*args, **kwargs):
+        with torch.autocast("cuda", dtype=torch.bfloat16, enabled=module.training):
+            out = forward(*args, **kwargs)
+
+        return out.float()
+
+    module.forward = wrapper
+
+
+class ChannelsLastTrainer(Trainer):
+    """
+    Trainer which feeds training batches in channels last memory format
+    and keeps dataloader workers alive between epochs.
+    """
+
+    def get_train_dataloader(self):
+        loader = super().get_train_dataloader()
+        use_workers = loader.num_workers > 0
+
+        return DataLoader(
+            loader.dataset,
+            batch_size=loader.batch_size,
+            sampler=loader.sampler,
+            num_workers=loader.num_workers,
+            pin_memory=loader.pin_memory,
+            drop_last=loader.drop_last,
+            collate_fn=channels_last_collate,
+            persistent_workers=use_workers,
+            prefetch_factor=4 if use_workers else None,
+        )
+
+
 parser = argparse.ArgumentParser(description="INN EDSR")
 parser.add_argument(
     "--checkpoint", default=None, help="path to model checkpoint (default: None)"
@@ -42,11 +91,28 @@ parser.add_argument(
     "--epochs", default=400, type=int, metavar="N", help="number of total epochs to run"
 )
 args = parser.parse_args()
+# Integral training samples new grid sizes each step,
+# so cuDNN benchmarking is enabled only for fixed weight shapes.
+torch.backends.cudnn.benchmark = (
+    not args.integral or args.grid_tuning or args.evaluate
+)
 
 # DATA
-augmented_dataset = load_dataset(
-    "eugenesiow/Div2k", f"bicubic_x{args.scale}", split="train"
-).map(augment_five_crop, batched=True, desc="Augmenting Dataset")
+augmented_dir = f"./div2k_x{args.scale}_aug"
+
+if os.path.isdir(augmented_dir):
+    augmented_dataset = load_from_disk(augmented_dir)
+else:
+    augmented_dataset = load_dataset(
+        "eugenesiow/Div2k", f"bicubic_x{args.scale}", split="train"
+    ).map(augment_five_crop, batched=True, desc="Augmenting Dataset")
+    # Save to temporary directory first, so interrupted run does not leave
+    # partially written dataset in place of the cache.
+    tmp_dir = augmented_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    augmented_dataset.save_to_disk(tmp_dir)
+    os.replace(tmp_dir, augmented_dir)
+
 train_dataset = TrainDataset(augmented_dataset)
 eval_dataset = EvalDataset(
     load_dataset("eugenesiow/Div2k", f"bicubic_x{args.scale}", split="validation")
@@ -89,6 +155,8 @@ if args.integral:
 if args.checkpoint is not None:
     model.load_state_dict(torch.load(args.checkpoint))
 
+model = model.to(memory_format=torch.channels_last)
+
 if args.integral:
     print("Compression: ", model.eval().calculate_compression())
 
@@ -102,7 +170,8 @@ training_args = TrainingArguments(
     dataloader_pin_memory=True,
 )
 
-trainer = Trainer(
+autocast_training_forward(model)
+trainer = ChannelsLastTrainer(
     model=model,
     args=training_args,
     train_dataset=train_dataset,
@@ -120,7 +189,9 @@ trainer.eval(1)
 
 url = 'http://people.rennes.inria.fr/Aline.Roumy/results/images_SR_BMVC12/input_groundtruth/butterfly_mini_d4_gaussian.bmp'
 image = Image.open(requests.get(url, stream=True).raw)
-inputs = ImageLoader.load_image(image).cuda()
+cpu_inputs = ImageLoader.load_image(image).pin_memory()
+inputs = cpu_inputs.to("cuda", non_blocking=True)
+inputs = inputs.to(memory_format=torch.channels_last)
 preds = model(inputs)
 ImageLoader.save_image(preds, f'scaled_{args.scale}x.png')
 ImageLoader.save_compare(inputs, preds, f'scaled_{args.scale}x_compare.png')
@@ -125,6 +125,16 @@ class IntegralTracer(torch.fx.Interpreter):
         if additional_hooks is not None:
             self.default_hooks.update(additional_hooks)
 
+    def reset_model(self):
+        """
+        Updates references to submodules of the traced graph.
+        Should be called after in-place modifications of the model
+        which do not change the graph topology (e.g. batch norm fusion),
+        instead of tracing the model again.
+        """
+        self.module = torch.fx.GraphModule(self.model, self.module.graph)
+        self.submodules = dict(self.module.named_modules())
+
     def build_groups(self, *args, initial_env=None, enable_io_processing=True):
         """
         Builds dependency groups of the neural network.
@@ -1,8 +1,10 @@
 import copy
+from functools import partial
 from typing import Any, Mapping
 import torch
 import torch.nn as nn
 from torch.nn.utils import parametrize
+from torch.fx._symbolic_trace import is_fx_tracing
 from .grid import GridND
 from .graph import IntegralTracer
 from .parametrizations import IntegralParameterization
@@ -16,7 +18,6 @@ from .utils import (
     get_parent_name,
     fuse_batchnorm,
     get_parent_module,
-    get_attr_by_name,
 )
 
 
@@ -30,16 +31,41 @@ class IntegralModel(nn.Module):
         Model with parametrized layers.
     groups: List[IntegralGroup].
         List related groups.
+    compile_model: bool.
+        If True, then forward pass of the model will be compiled with torch.compile.
+        Grids are generated outside of the compiled region.
+        Compiled forward is used in evaluation mode and in training with fixed
+        size grids (e.g. TrainableGrid1D or default RandomLinspace grids).
+        Training with grids which sample sizes from a distribution with
+        min_val != max_val would trigger recompilation on each step, so it uses
+        the original model, as well as torch.fx tracing of the model
+        (e.g. in grid_tuning with train_bn=True).
     """
 
-    def __init__(self, model, groups):
+    def __init__(self, model, groups, compile_model=False):
         super(IntegralModel, self).__init__()
         self.model = model
         groups.sort(key=lambda g: g.count_parameters())
         self.groups = nn.ModuleList(groups)
+        modules = dict(self.model.named_modules())
+        self._parent_cache = {
+            p["name"]: modules[get_parent_name(p["name"])[0]]
+            for group in self.groups
+            for p in group.params
+        }
         # Rename groups to integral_groups
-        self.original_size = None
-        self.original_size = self.calculate_compression()
+        self._size_tensors = None
+        self._size_parametrized = None
+        self.original_size = self._compute_raw_size()
+        self._grid_dirty = True
+        # Stored in __dict__ to avoid registration of compiled module,
+        # which shares parameters with self.model.
+        self.__dict__["_compiled_model"] = None
+
+        if compile_model:
+            self.__dict__["_compiled_model"] = torch.compile(
+                self.model, mode="max-autotune", fullgraph=False
+            )
 
     def generate_grid(self):
         """Creates new grids in each group."""
@@ -53,6 +79,8 @@ class IntegralModel(nn.Module):
 
     def load_state_dict(self, state_dict: Mapping[str, Any], strict: bool = True):
         out = super().load_state_dict(state_dict, strict)
+        self._size_tensors = None
+        self._grid_dirty = True
         self.clear()
 
         return out
@@ -70,35 +98,74 @@ class IntegralModel(nn.Module):
         -------
         Model's output.
         """
-        self.generate_grid()
+        # Grids are sampled randomly only in training mode,
+        # in evaluation mode they change only after resize or reset.
+        if self.training or self._grid_dirty:
+            self.generate_grid()
+            self._grid_dirty = self.training
+
+        if self._compiled_model is not None and not is_fx_tracing():
+            random_grids = self.training and any(
+                hasattr(group.grid, "distribution")
+                and group.grid.distribution.min_val != group.grid.distribution.max_val
+                for group in self.groups
+            )
+
+            if not random_grids:
+                return self._compiled_model(x)
 
         return self.model(x)
 
-    def calculate_compression(self):
+    def _build_size_cache(self):
         """
-        Returns 1 - ratio of the size of the current
-        model to the original size of the model.
+        Collects discrete parameters and parametrized attributes of the model
+        which are counted by ``calculate_compression``.
+        Parametrized attributes are stored as (module, attribute name) pairs,
+        because their size depends on the current grid.
         """
-        out = 0
-        self.generate_grid()
-
-        for group in self.groups:
-            group.clear()
+        self._size_tensors = []
+        self._size_parametrized = []
 
         for name, param in self.model.named_parameters():
             if "parametrizations." not in name:
-                out += param.numel()
+                self._size_tensors.append(param)
             elif name.endswith(".original"):
                 name = name.replace(".original", "")
                 name = name.replace("parametrizations.", "")
-                tensor = get_attr_by_name(self.model, name)
-                out += tensor.numel()
+                _, attr_name = get_parent_name(name)
+                parent = get_parent_module(self.model, name)
+                self._size_parametrized.append((parent, attr_name))
+
+    def _compute_raw_size(self):
+        """
+        Returns number of elements in the model's tensors
+        sampled on the current grids. Grids are not regenerated.
+        """
+        if self._size_tensors is None:
+            self._build_size_cache()
 
-        if self.original_size is not None:
-            out = 1.0 - out / self.original_size
+        out = sum(t.numel() for t in self._size_tensors)
+        out += sum(
+            getattr(parent, attr_name).numel()
+            for parent, attr_name in self._size_parametrized
+        )
 
         return out
 
+    def calculate_compression(self):
+        """
+        Returns 1 - ratio of the size of the current
+        model to the original size of the model.
+        """
+        self.generate_grid()
+
+        for group in self.groups:
+            group.clear()
+
+        out = self._compute_raw_size()
+
+        return 1.0 - out / self.original_size
+
     def resize(self, sizes):
         """
         Resizes grids in each group.
@@ -111,10 +178,14 @@ class IntegralModel(nn.Module):
         for group, size in zip(self.groups, sizes):
             group.resize(size)
 
+        self._grid_dirty = True
+
     def reset_grids(self, grids):
         for group, grid in zip(self.groups, grids):
             group.reset_grid(grid)
 
+        self._grid_dirty = True
+
     def reset_distributions(self, distributions):
         """
         Sets new distributions in each IntegralGroup.grid.
@@ -127,17 +198,20 @@ class IntegralModel(nn.Module):
         for group, dist in zip(self.groups, distributions):
             group.reset_distribution(dist)
 
+        self._grid_dirty = True
+
     def grids(self):
         """Returns list of grids of each integral group."""
         return [group.grid for group in self.groups]
 
     def __getattr__(self, item):
-        if item in dir(self):
-            out = super().__getattr__(item)
-        else:
-            out = getattr(self.model, item)
+        try:
+            return super().__getattr__(item)
+        except AttributeError:
+            if item == "model":
+                raise
 
-        return out
+            return getattr(self.model, item)
 
     def transform_to_discrete(self):
         """Samples weights, removes parameterizations and returns discrete model."""
@@ -180,25 +254,36 @@ class IntegralModel(nn.Module):
                 if group.subgroups is None:
                     group.reset_grid(TrainableGrid1D(group.grid_size()))
 
-        for name, param in self.named_parameters():
-            parent = get_parent_module(self, name)
+            self._grid_dirty = True
 
-            if isinstance(parent, TrainableGrid1D):
-                param.requires_grad = True
-            else:
-                param.requires_grad = False
+        trainable = set()
 
         if train_bn:
+            param_ids = set(id(p) for p in self.parameters())
             reset_batchnorm(self)
+            self._size_tensors = None
+            trainable.update(
+                id(p) for p in self.parameters() if id(p) not in param_ids
+            )
 
         if train_bias:
             for group in self.groups:
                 for p in group.params:
                     if "bias" in p["name"]:
-                        parent = get_parent_module(self.model, p["name"])
+                        parent = self._parent_cache[p["name"]]
                         if parametrize.is_parametrized(parent, "bias"):
                             parametrize.remove_parametrizations(parent, "bias", True)
-                        getattr(parent, "bias").requires_grad = True
+                            self._size_tensors = None
+
+                        trainable.add(id(getattr(parent, "bias")))
+
+        modules = dict(self.named_modules())
+
+        for name, param in self.named_parameters():
+            parent = modules[get_parent_name(name)[0]]
+            param.requires_grad = (
+                isinstance(parent, TrainableGrid1D) or id(param) in trainable
+            )
 
 
 class IntegralWrapper:
@@ -226,6 +311,9 @@ class IntegralWrapper:
         Number of iterations of total variation optimization process.
     verbose: bool.
         If True, then information about model convertation process will be printed.
+    compile_model: bool.
+        If True, then forward pass of the resulting IntegralModel
+        will be compiled with torch.compile.
     """
 
     def __init__(
@@ -238,6 +326,7 @@ class IntegralWrapper:
         build_functions=None,
         permutation_iters=100,
         verbose=True,
+        compile_model=False,
     ):
         self.init_from_discrete = init_from_discrete
         self.fuse_bn = fuse_bn
@@ -245,6 +334,7 @@ class IntegralWrapper:
         self.start_lr = start_lr
         self.build_functions = build_functions
         self.verbose = verbose
+        self.compile_model = compile_model
         self.rearranger = None
 
         if permutation_config is not None:
@@ -264,6 +354,18 @@ class IntegralWrapper:
         groups: List[IntegralGroup].
             List of related integral groups.
         """
+        offsets = {}
+
+        for group in groups:
+            for parent in group.parents:
+                if id(parent) not in offsets:
+                    start = 0
+                    offsets[id(parent)] = {}
+
+                    for subgroup in parent.subgroups:
+                        offsets[id(parent)].setdefault(id(subgroup), start)
+                        start += subgroup.size
+
         for i, group in enumerate(groups):
             params = list(group.params)
             feature_maps = group.tensors
@@ -272,13 +374,7 @@ class IntegralWrapper:
                 print(f"Rearranging of group {i}")
 
             for parent in group.parents:
-                start = 0
-
-                for another_group in parent.subgroups:
-                    if group is not another_group:
-                        start += another_group.size
-                    else:
-                        break
+                start = offsets[id(parent)][id(group)]
 
                 for p in parent.params:
                     params.append(
@@ -333,25 +429,41 @@ class IntegralWrapper:
         tracer = IntegralTracer(
             model, continuous_dims, discrete_dims, custom_operations, custom_hooks
         )
-        tracer.build_groups(example_input)
+        groups = tracer.build_groups(example_input)
 
         if self.fuse_bn:
             integral_convs = set()
+            modules_by_name = dict(model.named_modules())
 
-            for name, _ in model.named_parameters():
-                if name in tracer.continuous_dims:
-                    parent = get_parent_module(model, name)
-                    dims = tracer.continuous_dims[name]
-
-                    if isinstance(parent, nn.Conv2d) and 0 in dims:
-                        integral_convs.add(get_parent_name(name)[0])
+            for name, dims in tracer.continuous_dims.items():
+                parent_name, attr_name = get_parent_name(name)
+                parent = modules_by_name.get(parent_name)
 
-            fuse_batchnorm(model.eval(), list(integral_convs))
+                if (
+                    isinstance(parent, nn.Conv2d)
+                    and attr_name in parent._parameters
+                    and 0 in dims
+                ):
+                    integral_convs.add(parent_name)
+
+            param_ids = set(id(p) for p in model.parameters())
+            fused = fuse_batchnorm(model.eval(), list(integral_convs))
+
+            if len(fused) > 0:
+                # Fusion adds bias to convolutions without it,
+                # which changes the graph, so the model is traced again.
+                if any(id(p) not in param_ids for p in model.parameters()):
+                    tracer = IntegralTracer(
+                        model,
+                        continuous_dims,
+                        discrete_dims,
+                        custom_operations,
+                        custom_hooks,
+                    )
+                else:
+                    tracer.reset_model()
 
-        tracer = IntegralTracer(
-            model, continuous_dims, discrete_dims, custom_operations, custom_hooks
-        )
-        groups = tracer.build_groups(example_input)
+                groups = tracer.build_groups(example_input)
 
         if self.init_from_discrete and self.rearranger is not None:
             self._rearrange(groups)
@@ -402,17 +514,24 @@ class IntegralWrapper:
         for group in groups:
             group.initialize_grids()
 
+        modules = dict(model.named_modules())
+        already_parametrized = {}
+
         for group in integral_groups:
             for p in group.params:
-                _, name = get_parent_name(p["name"])
-                parent = get_parent_module(model, p["name"])
-
-                if not parametrize.is_parametrized(parent, name) or all(
-                    [
-                        not isinstance(obj, IntegralParameterization)
+                parent_name, name = get_parent_name(p["name"])
+                parent = modules[parent_name]
+                key = (id(parent), name)
+
+                if key not in already_parametrized:
+                    already_parametrized[key] = parametrize.is_parametrized(
+                        parent, name
+                    ) and any(
+                        isinstance(obj, IntegralParameterization)
                         for obj in parent.parametrizations[name]
-                    ]
-                ):
+                    )
+
+                if not already_parametrized[key]:
                     if (
                         self.build_functions is not None
                         and type(parent) in self.build_functions
@@ -444,6 +563,7 @@ class IntegralWrapper:
                     parametrize.register_parametrization(
                         parent, name, parametrization, unsafe=True
                     )
+                    already_parametrized[key] = True
 
                     if self.init_from_discrete:
                         self._optimize_parameters(parent, p["name"], target)
@@ -453,7 +573,7 @@ class IntegralWrapper:
 
                 p["function"] = parametrization
 
-        integral_model = IntegralModel(model, integral_groups)
+        integral_model = IntegralModel(model, integral_groups, self.compile_model)
 
         return integral_model
 
@@ -473,6 +593,15 @@ class IntegralWrapper:
         """
         module.train()
         _, attr = get_parent_name(name)
+        parametrizations = module.parametrizations[attr]
+
+        # Call single parametrization directly, otherwise
+        # the whole chain of parametrizations is applied.
+        if len(parametrizations) == 1:
+            weight_fn = partial(parametrizations[0], parametrizations.original)
+        else:
+            weight_fn = parametrizations
+
         criterion = torch.nn.MSELoss()
         opt = torch.optim.Adam(module.parameters(), lr=self.start_lr, weight_decay=0.0)
         scheduler = torch.optim.lr_scheduler.StepLR(
@@ -483,19 +612,18 @@ class IntegralWrapper:
             print(name)
             print(
                 "loss before optimization: ",
-                float(criterion(getattr(module, attr), target)),
+                float(criterion(weight_fn(), target)),
             )
 
-        for i in range(self.optimize_iters):
-            weight = getattr(module, attr)
-            loss = criterion(weight, target)
+        for _ in range(self.optimize_iters):
+            loss = criterion(weight_fn(), target)
             loss.backward()
             opt.step()
             scheduler.step()
-            opt.zero_grad()
+            opt.zero_grad(set_to_none=True)
 
-            if i == self.optimize_iters - 1 and self.verbose:
-                print("loss after optimization: ", float(loss))
+        if self.optimize_iters > 0 and self.verbose:
+            print("loss after optimization: ", float(loss.detach()))
 
 
 def build_base_parameterization(module, name, dims, scale=1.0):
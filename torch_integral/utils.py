@@ -62,9 +62,15 @@ def fuse_batchnorm(model, convs):
     ----------
     model: torch.nn.Module.
     convs: List[torch.nn.ConvNd].
+
+    Returns
+    -------
+    List[str].
+        Names of convolutions which were fused with batch norm.
     """
     fx_model: fx.GraphModule = fx.symbolic_trace(model)
     modules = dict(fx_model.named_modules())
+    fused = []
 
     for node in fx_model.graph.nodes:
         if node.op != "call_module":
@@ -82,6 +88,9 @@ def fuse_batchnorm(model, convs):
                 parent_name, attr_name = get_parent_name(node.target)
                 parent = get_parent_module(model, node.target)
                 setattr(parent, attr_name, torch.nn.Identity())
+                fused.append(node.args[0].target)
+
+    return fused
 
 
 def inplace_conv_bn_fusion(conv, bn):